@@ -1,10 +1,24 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
+import plotly.io as pio
+from tsdownsample import LTTBDownsampler
 import s3fs
 import gcsfs
+import asyncio
+import io
 import json
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from fsspec.core import url_to_fs
+
+# Serialize figures with orjson (handles numpy arrays natively) when Streamlit ships them to the browser
+pio.json.config.default_engine = 'orjson'
+
+logger = logging.getLogger(__name__)
 
 st.title('Cloud Bucket Browser (S3/GCS): View CSV/XLS(X) as Tables and Graphs')
 
@@ -12,7 +26,22 @@ st.title('Cloud Bucket Browser (S3/GCS): View CSV/XLS(X) as Tables and Graphs')
 # Helpers
 # ----------------------------
 ALLOWED_EXTS = {'.csv', '.xls', '.xlsx'}
+_ALLOWED_TUPLE = tuple(ALLOWED_EXTS)
 EXPECTED_TIME_SERIES = {'Frame Number', 'Procrustes Similarity', 'Joint Angle Distance'}
+LARGE_FILE_CHUNK_ROWS = 50_000
+LARGE_FILE_MAX_ROWS = 200_000
+PREFETCH_MAX_DIRS = 5
+LISTINGS_EXPIRY_SECONDS = 60
+# fsspec's in-process dircache for the browsing fs; pandas reads do not list, so they skip it
+LISTINGS_CACHE = {'use_listings_cache': True, 'listings_expiry_time': LISTINGS_EXPIRY_SECONDS, 'skip_instance_cache': False}
+READ_BLOCK_SIZE = 16 * 2**20  # larger sequential GETs for top-to-bottom CSV/Excel reads
+PEEK_BLOCK_SIZE = 64 * 2**10
+PREVIEW_ROWS = 50
+DOWNSAMPLE_THRESHOLD = 5000
+DOWNSAMPLE_POINTS = 2500
+HOVER_LIMIT_ROWS = 50_000
+BAR_MAX_CATEGORIES = 50
+PLOTLY_CONFIG = {'scrollZoom': True, 'responsive': True}
 
 def detect_scheme(url: str) -> str:
     if not url:
@@ -46,24 +75,31 @@ def basename_from_path(p: str) -> str:
     return p.rsplit('/', 1)[-1] if '/' in p else p
 
 def is_allowed_file(name: str) -> bool:
-    lname = name.lower()
-    return any(lname.endswith(ext) for ext in ALLOWED_EXTS)
+    return name.lower().endswith(_ALLOWED_TUPLE)
+
+def fs_tuning(scheme: str) -> dict:
+    # Block/readahead settings shared by the browsing fs and the pandas read path
+    if scheme == 's3':
+        return {'default_block_size': READ_BLOCK_SIZE, 'default_cache_type': 'readahead', 'cache_regions': True}
+    if scheme == 'gs':
+        return {'block_size': READ_BLOCK_SIZE}
+    return {}
 
 def get_fs(scheme: str, *, anon: bool,
            aws_access_key_id: str = '', aws_secret_access_key: str = '', aws_session_token: str = '', region_name: str = '',
            gcs_token=None):
     if scheme == 's3':
         if anon:
-            return s3fs.S3FileSystem(anon=True)
+            return s3fs.S3FileSystem(anon=True, **fs_tuning('s3'), **LISTINGS_CACHE)
         kwargs = {}
         if aws_access_key_id and aws_secret_access_key:
             kwargs.update(dict(key=aws_access_key_id, secret=aws_secret_access_key, token=aws_session_token or None))
         if region_name:
             kwargs.update(dict(client_kwargs={'region_name': region_name}))
-        return s3fs.S3FileSystem(**kwargs)
+        return s3fs.S3FileSystem(**kwargs, **fs_tuning('s3'), **LISTINGS_CACHE)
     if scheme == 'gs':
         token = 'anon' if anon else (gcs_token if gcs_token is not None else 'google_default')
-        return gcsfs.GCSFileSystem(token=token)
+        return gcsfs.GCSFileSystem(token=token, **fs_tuning('gs'), **LISTINGS_CACHE)
     raise ValueError("Unsupported scheme. Use s3:// or gs://")
 
 def build_storage_options(scheme: str, *, anon: bool,
@@ -78,20 +114,50 @@ def build_storage_options(scheme: str, *, anon: bool,
                 opts['token'] = aws_session_token
         if region_name:
             opts['client_kwargs'] = {'region_name': region_name}
+        opts.update(fs_tuning('s3'))
         return opts
     if scheme == 'gs':
         token = 'anon' if anon else (gcs_token if gcs_token is not None else 'google_default')
-        return {'token': token}
+        return {'token': token, **fs_tuning('gs')}
     return {}
 
-def list_cloud(fs, scheme: str, prefix: str):
-    # Returns (dirs, files) with full scheme:// paths
+def connection_key(scheme: str, storage_options: dict) -> str:
+    # Stable string identifying a connection, used as a cache key
+    return scheme + '|' + json.dumps(storage_options, sort_keys=True, default=str)
+
+async def _async_ls_many(fs, paths: list):
+    return await asyncio.gather(*[fs._ls(p, detail=True) for p in paths], return_exceptions=True)
+
+def _log_prefetch_result(future):
     try:
-        _, without = strip_scheme(prefix)
-        items = fs.ls(without, detail=True)
+        results = future.result()
     except Exception as e:
-        st.error(f"Failed to list '{prefix}': {e}")
-        return [], []
+        logger.warning("Listing prefetch failed: %s", e)
+        return
+    for r in results:
+        if isinstance(r, Exception):
+            logger.warning("Listing prefetch failed: %s", r)
+
+def prefetch_listings(fs, paths: list):
+    # Warm fsspec's dircache for the subfolders of a small folder, scheduled on fsspec's loop
+    # without waiting. Skipped for larger folders, where most prefetched LISTs would be wasted.
+    if not paths or len(paths) > PREFETCH_MAX_DIRS or not getattr(fs, 'async_impl', False):
+        return
+    try:
+        future = asyncio.run_coroutine_threadsafe(_async_ls_many(fs, paths), fs.loop)
+    except Exception as e:
+        logger.warning("Listing prefetch could not be scheduled: %s", e)
+        return
+    future.add_done_callback(_log_prefetch_result)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _list_cloud_cached(_fs, scheme: str, prefix: str, fs_key: str):
+    # _fs is not hashed by Streamlit; fs_key identifies the connection instead
+    _, without = strip_scheme(prefix)
+    items = _fs.ls(without, detail=True, refresh=False)
+    # Built once per listing instead of an f-string rebuild_url() call per item
+    scheme_prefix = scheme + '://'
+    base = scheme_prefix + without.rstrip('/') + '/'
     dirs_set, files = set(), []
     for it in items:
         name = it.get('name') or it.get('Key') or ''
@@ -99,59 +165,183 @@ def list_cloud(fs, scheme: str, prefix: str):
         rel = full_without[len(without):] if full_without.startswith(without) else full_without
         # If provider supplies explicit directory type
         if it.get('type') == 'directory' or full_without.endswith('/'):
-            dirs_set.add(rebuild_url(scheme, full_without.rstrip('/') + '/'))
+            dirs_set.add(scheme_prefix + full_without.rstrip('/') + '/')
             continue
         # Derive child dirs from first component in rel
         if '/' in rel:
             child = rel.split('/', 1)[0]
-            dirs_set.add(rebuild_url(scheme, without.rstrip('/') + '/' + child.strip('/') + '/'))
+            dirs_set.add(base + child.strip('/') + '/')
         else:
-            full_url = rebuild_url(scheme, full_without)
+            full_url = scheme_prefix + full_without
             if is_allowed_file(full_url):
                 files.append(full_url)
-    dirs = sorted(dirs_set, key=lambda x: x.lower())
-    files.sort(key=lambda x: x.lower())
+    dirs = sorted(dirs_set, key=str.lower)
+    files.sort(key=str.lower)
+    prefetch_listings(_fs, [d[len(scheme_prefix):] for d in dirs])
     return dirs, files
 
-def read_any(path: str) -> pd.DataFrame:
-    storage_options = st.session_state.get('storage_options', {})
+def list_cloud(fs, scheme: str, prefix: str):
+    # Returns (dirs, files) with full scheme:// paths
+    fs_key = st.session_state.get('fs_key', '')
+    try:
+        return _list_cloud_cached(fs, scheme, prefix, fs_key)
+    except Exception as e:
+        st.error(f"Failed to list '{prefix}': {e}")
+        return [], []
+
+def _peek_columns(path: str, storage_options: dict) -> list:
+    # Header-only read to discover the CSV columns. Uses small uncached range reads rather than
+    # the tuned READ_BLOCK_SIZE readahead, which would fetch a whole 16 MiB block for one line.
+    fs, fs_path = url_to_fs(path, **storage_options)
+    with fs.open(fs_path, 'rb', block_size=PEEK_BLOCK_SIZE, cache_type='none') as f:
+        header = f.readline()
+    return pd.read_csv(io.BytesIO(header), nrows=0).columns.tolist()
+
+def read_csv_fast(path: str, storage_options: dict, large_file_mode: bool = False) -> pd.DataFrame:
+    # Time-series files only need the plotted columns; pyarrow parses multithreaded
+    cols = _peek_columns(path, storage_options)
+    usecols = [c for c in cols if c in EXPECTED_TIME_SERIES] if EXPECTED_TIME_SERIES.issubset(cols) else None
+    if large_file_mode:
+        # Stream in chunks and stop at LARGE_FILE_MAX_ROWS (pyarrow engine has no chunksize)
+        reader = pd.read_csv(path, usecols=usecols, dtype_backend='pyarrow', chunksize=LARGE_FILE_CHUNK_ROWS,
+                             storage_options=storage_options)
+        with reader:
+            max_chunks = max(1, LARGE_FILE_MAX_ROWS // LARGE_FILE_CHUNK_ROWS)
+            return pd.concat(list(islice(reader, max_chunks)), ignore_index=True)
+    return pd.read_csv(path, engine='pyarrow', usecols=usecols, dtype_backend='pyarrow',
+                       storage_options=storage_options)
+
+@st.cache_data(max_entries=8, ttl=300, show_spinner=False)
+def _read_any_cached(path: str, storage_options_repr: str, large_file_mode: bool = False) -> pd.DataFrame:
+    storage_options = json.loads(storage_options_repr)
     if path.lower().endswith('.csv'):
-        return pd.read_csv(path, storage_options=storage_options)
-    return pd.read_excel(path, storage_options=storage_options)
+        return read_csv_fast(path, storage_options, large_file_mode)
+    return pd.read_excel(path, dtype_backend='pyarrow', storage_options=storage_options)
+
+def _read_params(paths: list):
+    # Resolve session-dependent read settings on the script thread
+    storage_options = st.session_state.get('storage_options', {})
+    large_file_mode = st.session_state.get('large_file_mode', False)
+    if large_file_mode:
+        for path in paths:
+            if not path.lower().endswith('.csv'):
+                st.warning(f"Excel files cannot be streamed; {basename_from_path(path)} is read in full.")
+    return json.dumps(storage_options, sort_keys=True), large_file_mode
+
+def read_many(paths: list) -> list:
+    # Fetch files concurrently; returns (df, error) pairs in input order.
+    # Workers only call the cached reader; all st.* rendering stays on the script thread.
+    if not paths:
+        return []
+    storage_options_repr, large_file_mode = _read_params(paths)
+
+    def _read(path: str):
+        try:
+            return _read_any_cached(path, storage_options_repr, large_file_mode), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=len(paths)) as ex:
+        return list(ex.map(_read, paths))
+
+def clear_loaded_data():
+    for key in [k for k in st.session_state.keys() if k.startswith('df::')]:
+        del st.session_state[key]
+
+def load_files(paths: list) -> list:
+    # Per-session stash on top of the cross-session cache_data layer; returns (df, error) pairs
+    missing = [p for p in paths if f'df::{p}' not in st.session_state]
+    errors = {}
+    for path, (df, err) in zip(missing, read_many(missing)):
+        if err is None:
+            st.session_state[f'df::{path}'] = df
+        else:
+            errors[path] = err
+    return [(st.session_state.get(f'df::{p}'), errors.get(p)) for p in paths]
+
+def downsample(x: np.ndarray, y: np.ndarray, n: int = DOWNSAMPLE_POINTS) -> np.ndarray:
+    # LTTB: indices of the n points that best preserve the visual shape of y over x.
+    # LTTB is not NaN-safe (gaps can hide spikes), so it only sees the non-NaN points.
+    pos = np.flatnonzero(~np.isnan(y))
+    if len(pos) <= n:
+        return pos
+    return pos[LTTBDownsampler().downsample(x[pos], y[pos], n_out=n)]
+
+def downsample_frame(df: pd.DataFrame, y_cols: list, x_col: str = None) -> pd.DataFrame:
+    # Keep the union of LTTB-selected rows across y_cols so each series stays faithful
+    if len(df) <= DOWNSAMPLE_THRESHOLD:
+        return df
+    if x_col is not None and df[x_col].is_monotonic_increasing:
+        x = df[x_col].to_numpy(dtype='float64', na_value=np.nan)
+    else:
+        x = np.arange(len(df), dtype='float64')
+    keep = np.unique(np.concatenate([
+        downsample(x, df[c].to_numpy(dtype='float64', na_value=np.nan)) for c in y_cols
+    ]))
+    return df.iloc[keep]
+
+def find_label_column(df: pd.DataFrame):
+    # First string column with few enough distinct values to act as bar labels
+    limit = max(50, int(len(df) * 0.8))
+    for c, dtype in df.dtypes.items():
+        if not pd.api.types.is_string_dtype(dtype):
+            continue
+        # A sample already over the limit rules the column out without a full scan
+        if df[c].head(1000).nunique() > limit:
+            continue
+        if df[c].nunique() <= limit:
+            return c
+    return None
+
+def limit_hover(fig, n_rows: int):
+    # Plotly's hover handler dominates interaction cost on large inputs
+    if n_rows > HOVER_LIMIT_ROWS:
+        fig.update_layout(hovermode='x', spikedistance=0)
 
 def plot_bar_interactive(df: pd.DataFrame, label_col: str, stat_col: str, title: str):
     fig = px.bar(df, x=label_col, y=stat_col, title=title, text=stat_col)
     fig.update_traces(texttemplate='%{text:.2f}', textposition='outside',
                       hovertemplate=f'{label_col}: %{{x}}<br>{stat_col}: %{{y}}')
     fig.update_layout(xaxis_tickangle=-45)
-    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(fig, use_container_width=True, config=PLOTLY_CONFIG)
 
 def validate_and_plot_bar_interactive(df: pd.DataFrame, label_col: str, stat_col: str, title: str):
     if stat_col not in df.columns or label_col not in df.columns:
         st.warning("Selected columns not found in the data.")
         return
-    if not pd.api.types.is_numeric_dtype(df[stat_col]):
+    if not pd.api.types.is_numeric_dtype(df[stat_col].dtype):
         st.warning(f"The selected statistic column '{stat_col}' is not numeric.")
         return
-    plot_bar_interactive(df, label_col, stat_col, title)
+    # One bar per label (same totals px.bar would stack); cap the category count sent to Plotly
+    totals = df.groupby(label_col, sort=False)[stat_col].sum()
+    if len(totals) > BAR_MAX_CATEGORIES:
+        totals = totals.nlargest(BAR_MAX_CATEGORIES)
+        title = f"{title} (top {BAR_MAX_CATEGORIES} by sum)"
+    plot_bar_interactive(totals.reset_index(), label_col, stat_col, title)
 
 def plot_csv_line_chart(df: pd.DataFrame):
+    metrics = ['Procrustes Similarity', 'Joint Angle Distance']
+    n_rows = len(df)
+    df = downsample_frame(df, metrics, x_col='Frame Number')
     fig = px.line(
         df,
         x='Frame Number',
-        y=['Procrustes Similarity', 'Joint Angle Distance'],
+        y=metrics,
         labels={'value': 'Metric Value', 'Frame Number': 'Frame Number', 'variable': 'Metric'},
-        title='Metrics over Frames'
+        title='Metrics over Frames',
+        render_mode='webgl'
     )
-    st.plotly_chart(fig, use_container_width=True)
+    limit_hover(fig, n_rows)
+    st.plotly_chart(fig, use_container_width=True, config=PLOTLY_CONFIG)
 
 def plot_generic_lines(df: pd.DataFrame, title: str):
-    num_cols = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+    num_cols = df.select_dtypes(include='number').columns.tolist()
     if not num_cols:
         st.info("No numeric columns to plot.")
         return
-    fig = px.line(df[num_cols], title=title)
-    st.plotly_chart(fig, use_container_width=True)
+    fig = px.line(downsample_frame(df[num_cols], num_cols), title=title, render_mode='webgl')
+    limit_hover(fig, len(df))
+    st.plotly_chart(fig, use_container_width=True, config=PLOTLY_CONFIG)
 
 # ----------------------------
 # Sidebar: connection + nav
@@ -191,6 +381,12 @@ else:
     creds_file = None
 
 connect = st.sidebar.button("Connect")
+st.sidebar.checkbox(f"Large file mode (first {LARGE_FILE_MAX_ROWS:,} CSV rows)", value=False, key="large_file_mode",
+                    on_change=clear_loaded_data)
+if st.sidebar.button("Clear data cache"):
+    # Drop both layers so the next Load and visualize re-reads from the bucket
+    _read_any_cached.clear()
+    clear_loaded_data()
 
 if connect and scheme:
     st.session_state['default_path'] = bucket_input
@@ -223,7 +419,9 @@ if connect and scheme:
         fs = get_fs(scheme='gs', anon=public, gcs_token=token)
         st.session_state['fs'] = fs
         st.session_state['scheme'] = 'gs'
-        st.session_state['storage_options'] = {'token': token}
+        st.session_state['storage_options'] = build_storage_options('gs', anon=public, gcs_token=token)
+    st.session_state['fs_key'] = connection_key(scheme, st.session_state['storage_options'])
+    clear_loaded_data()
 
 # Initialize defaults if not set
 fs = st.session_state.get('fs')
@@ -233,9 +431,14 @@ current_scheme = st.session_state.get('scheme', detect_scheme(current_prefix))
 # ----------------------------
 # Main UI
 # ----------------------------
-if not fs or not current_prefix or not current_scheme:
-    st.info("Enter your bucket/prefix (gs:// or s3://) and click Connect.")
-else:
+@st.fragment
+def browse_section():
+    # Runs as a fragment: navigation and file widgets rerun only this section, not the sidebar/auth code.
+    # Fragment reruns reuse the original call arguments, so state is read from st.session_state here.
+    fs = st.session_state['fs']
+    current_prefix = st.session_state['prefix']
+    current_scheme = st.session_state.get('scheme', detect_scheme(current_prefix))
+
     st.subheader("Browse folders")
     st.caption(f"Current prefix: {current_prefix}")
 
@@ -251,7 +454,8 @@ else:
         st.session_state['prefix'] = rebuild_url(scheme, new_without)
         current_prefix = st.session_state['prefix']
     if refresh_col.button("🔄 Refresh"):
-        pass
+        fs.invalidate_cache(strip_scheme(current_prefix)[1])
+        _list_cloud_cached.clear()
 
     dirs, files = list_cloud(fs, current_scheme, current_prefix)
 
@@ -281,24 +485,27 @@ else:
 
         visualize = st.button("Load and visualize")
         if visualize and selected_files:
-            for fp in selected_files:
+            for fp, (df, err) in zip(selected_files, load_files(selected_files)):
                 st.markdown(f"### {basename_from_path(fp)}")
-                try:
-                    df = read_any(fp)
-                except Exception as e:
-                    st.error(f"Failed to read {fp}: {e}")
+                if err is not None:
+                    st.error(f"Failed to read {fp}: {err}")
                     continue
 
-                st.dataframe(df.head(50), use_container_width=True)
+                st.caption(f"Loaded {len(df):,} rows")
+                st.dataframe(df.head(PREVIEW_ROWS), use_container_width=True)
 
                 if EXPECTED_TIME_SERIES.issubset(df.columns):
                     plot_csv_line_chart(df)
                 else:
-                    num_cols = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
-                    cand_label_cols = [c for c in df.columns if df[c].dtype == 'object' and df[c].nunique() <= max(50, int(len(df)*0.8))]
-                    if num_cols and cand_label_cols:
-                        label_col = cand_label_cols[0]
+                    num_cols = df.select_dtypes(include='number').columns.tolist()
+                    label_col = find_label_column(df) if num_cols else None
+                    if label_col is not None:
                         stat_col = num_cols[0]
                         validate_and_plot_bar_interactive(df, label_col, stat_col, title=f"Bar: {label_col} vs {stat_col}")
                     else:
-                        plot_generic_lines(df, title="Line plot (numeric columns)")
\ No newline at end of file
+                        plot_generic_lines(df, title="Line plot (numeric columns)")
+
+if not fs or not current_prefix or not current_scheme:
+    st.info("Enter your bucket/prefix (gs:// or s3://) and click Connect.")
+else:
+    browse_section()